@@ -1,14 +1,244 @@
 import streamlit as st
-from google import genai
-from firecrawl import Firecrawl
-from PIL import Image
-import json
+import orjson
 import re
-import traceback
 import os
 import time
-from urllib.parse import urlparse
-from io import BytesIO
+import random
+import queue
+import threading
+import hashlib
+import pickle
+import sqlite3
+import uuid
+import socket
+import ipaddress
+from collections import deque
+from contextlib import closing
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, CancelledError, Future
+from functools import partial
+from itertools import islice, count
+from html import unescape, escape
+from typing import NamedTuple
+from urllib.parse import urlparse, urlunparse, urljoin, parse_qsl, urlencode, quote
+
+# Models raced in order; each fallback starts when the previous one fails
+# or has not streamed anything after FALLBACK_STAGGER seconds.
+GEMINI_MODELS = ("gemini-2.0-flash", "gemini-2.5-flash")
+# Flash-Lite has the lowest time-to-first-token but no google_search grounding,
+# so it only leads the chain for tool-free calls.
+LOW_LATENCY_MODELS = ("gemini-2.0-flash-lite", "gemini-2.0-flash")
+FALLBACK_STAGGER = 2.0
+# Client-side per-model request budget (free tier: 15 RPM); requests queue instead of hitting 429
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 15))
+# Each stream holds a thread for its whole duration and a link scan can hold four (race plus backup race),
+# so this is sized for about ten concurrent scans rather than one
+GEMINI_WORKERS = int(os.environ.get("GEMINI_WORKERS", 40))
+# A key that hit a rate limit sits out of the rotation for this long
+KEY_COOLDOWN_SECONDS = 60
+# A scrape still pending after this long starts the search-based backup speculatively
+SPECULATIVE_BACKUP_DELAY = 3.0
+MAX_OUTPUT_TOKENS = 2048
+
+# Structured-output schema for calls without tools (google_search cannot be combined with it).
+# "score" is ordered early so the streamed preview can show it first.
+_STRING_LIST = {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+ANALYSIS_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'product_name': {'type': 'STRING'},
+        'score': {'type': 'INTEGER'},
+        'key_complaints': _STRING_LIST,
+        'reviews_summary': _STRING_LIST,
+        'detailed_technical_analysis': {
+            'type': 'OBJECT',
+            'properties': {
+                'Price Check': _STRING_LIST,
+                'Spec Verify': _STRING_LIST,
+                'Build Quality': _STRING_LIST,
+                'Likely Failures': _STRING_LIST,
+            },
+        },
+    },
+    'required': ['product_name', 'score', 'key_complaints', 'reviews_summary', 'detailed_technical_analysis'],
+    'property_ordering': ['product_name', 'score', 'key_complaints', 'reviews_summary', 'detailed_technical_analysis'],
+}
+
+# Prompt context is built from the most product-dense markdown blocks, not the page head
+PROMPT_CONTENT_TOKENS = 1500
+CHARS_PER_TOKEN = 4  # Rough Gemini average for English markdown; avoids a count_tokens round trip
+_INLINE_IMAGE_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)|data:image/[^)\s]+')
+_SPACE_RUN_RE = re.compile(r'[ \t\u00a0]{2,}')
+_SIGNAL_RE = re.compile(
+    r'[$€£★☆]|\b(?:reviews?|ratings?|stars?|prices?|shipping|warranty|materials?|battery|specs?|capacity|resolution|'
+    r'\d+\s?(?:mah|w|gb|tb|hz|lumens?|mp))\b',
+    re.IGNORECASE
+)
+_LINK_ONLY_LINE_RE = re.compile(r'^\s*(?:[-*]\s*)?\[[^\]]*\]\([^)]*\)\s*$')
+_INLINE_LINK_RE = re.compile(r'\[([^\]]*)\]\([^)]*\)')  # Keeps the anchor text; tracking-laden URLs are pure token cost
+
+# Uploads are shrunk before Gemini Vision; its token cost scales with pixel tiles
+MAX_UPLOAD_EDGE = 1024
+UPLOAD_JPEG_QUALITY = 85
+HISTORY_THUMB_EDGE = 400  # Screenshot kept for playback; the evidence panel shows it 200 px wide
+
+_PARTIAL_SCORE_RE = re.compile(r'"score"\s*:\s*"?(\d+)')
+_FENCE_RE = re.compile(r'\A\s*```(?:json)?|```\s*\Z')  # Only the wrapping fence; ``` inside strings is content
+_CTRL_TABLE = str.maketrans({c: ' ' for c in [*range(0x20), 0x7f]})
+
+# Anti-bot interstitials announce themselves at the top of the page
+_TRAP_RE = re.compile(r'captcha|robot check|login|access denied|verify you are (?:a )?human', re.IGNORECASE)
+TRAP_SCAN_CHARS = 4096
+MIN_PAGE_CHARS = 500  # Below this a scrape is an empty shell; retrying will not help
+# Trap pages are retried with fresh, uncached scrapes, a second one joining if the first is slow
+SCRAPE_RETRY_ATTEMPTS = 2
+SCRAPE_RETRY_BACKOFF = 0.5  # Base sleep after a failure, doubled per attempt plus jitter so users do not retry in lockstep
+SCRAPE_RETRY_BACKOFF_CAP = 8.0
+SCRAPE_RETRY_HEDGE = 4.0  # A still-running attempt gets a parallel one after this long; no sleep, it has not failed
+SCRAPE_RETRY_BUDGET = 20.0  # Seconds before a hung retry is abandoned for the search backup
+
+# Disk-backed L2 cache shared by every session and surviving restarts
+CACHE_DB_PATH = os.environ.get("VERITAS_CACHE_DB", ".veritas_cache.sqlite3")
+SCRAPE_TTL_SECONDS = 24 * 60 * 60
+RESULT_TTL_SECONDS = 24 * 60 * 60
+PROMPT_VERSION = 2  # Bump when prompts or scoring rules change so cached verdicts are not reused
+LLM_TTL_SECONDS = 24 * 60 * 60  # Raw model text keyed on prompt, config and model list
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # Past every TTL; the gap is what the stale scrape fallback can still use
+CACHE_MAX_ROWS = 5000  # Oldest rows beyond this are pruned so the file cannot grow without bound
+CACHE_PRUNE_EVERY = 200  # Writes between prunes; also pruned once when the store is opened
+
+# Session history keeps only sidebar fields; full reports live in the disk cache under "history:<id>"
+MAX_HISTORY = 50
+SIDEBAR_HISTORY_ITEMS = 20  # The sidebar lists only the newest scans
+
+# Storefronts whose anti-bot wall makes scraping pointless; go straight to search
+HOSTILE_DOMAINS = ("aliexpress", "temu")
+SCRAPE_FORMATS = ['markdown']
+SCRAPE_EXCLUDE_TAGS = ['nav', 'footer', 'header', 'aside', 'script', 'style']
+SCRAPE_WAIT_MS = 2000  # Enough for most product pages to hydrate
+SCRAPE_TIMEOUT_MS = 15000  # A hung site fails fast and the search backup takes over
+# Concurrent fetches allowed per retailer host across all sessions; bursts from one shop trip its bot wall
+HOST_FETCH_CONCURRENCY = 2
+FETCH_WORKERS = 8  # Page fetches get their own pool; threads parked on a host semaphore cannot starve Gemini streams
+
+# A plain GET races Firecrawl; static pages that already carry enough text skip the wait
+PLAIN_FETCH_TIMEOUT = 5  # Per connect/read
+PLAIN_FETCH_DEADLINE = 8.0  # Whole fetch, redirects and body included; a slow-drip server is cut off here
+PLAIN_FETCH_MAX_BYTES = 2 * 1024 * 1024  # Product text sits well inside this; the rest is never downloaded
+PLAIN_FETCH_CHUNK_BYTES = 64 * 1024
+PLAIN_FETCH_MIN_CHARS = 2000
+PLAIN_FETCH_MAX_REDIRECTS = 3  # Followed by hand so every hop gets the public-address check
+PLAIN_FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+                  '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
+}
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style|noscript|svg)\b.*?</\1>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+_OG_IMAGE_RE = re.compile(r'<meta[^>]+property=["\']og:image["\'][^>]*content=["\']([^"\']+)', re.IGNORECASE)
+
+# Storefront item IDs, used to name the product when the URL has no readable slug
+_ITEM_ID_PATTERNS = {
+    "aliexpress": (re.compile(r'/item/(\d+)\.html'), "AliExpress Item {}"),
+    "amazon": (re.compile(r'/(?:dp|gp/product)/([A-Z0-9]{10})'), "Amazon Item {}"),
+    "temu": (re.compile(r'goods_id=(\d+)'), "Temu Item {}"),
+}
+
+# Optional resizing proxy for remote product photos, e.g.
+# "https://images.weserv.nl/?url={url}&w={width}&output=webp". Off by default: it shares the URL with a third party.
+IMAGE_PROXY_TEMPLATE = os.environ.get("VERITAS_IMAGE_PROXY")
+EVIDENCE_IMAGE_WIDTH = 200
+
+# Query parameters that never change which product a URL points at
+TRACKING_PARAM_PREFIXES = ("utm_", "fbclid", "gclid", "spm", "_randl", "scm")
+# Matched exactly: a "ref" prefix would also drop real parameters such as refurbished=1
+TRACKING_PARAM_NAMES = frozenset(("ref", "ref_"))
+
+# Sent as the system instruction on every call so all requests share one stable prefix
+CONSISTENCY_RULES = """
+VERITAS SCORING GRID (STRICT COMPLIANCE):
+LOOKUP TABLE (Max Scores):
+| CATEGORY | PRICE LIMIT | MAX SCORE | VERDICT |
+| :--- | :--- | :--- | :--- |
+| Drone / Quadcopter | < $60 | 35 | TOY GRADE / JUNK |
+| Projector (1080p/4K) | < $80 | 35 | FAKE SPECS / DIM |
+| Smartwatch (Clone) | < $40 | 35 | E-WASTE / LAGGY |
+| Earbuds (TWS) | < $30 | 35 | POOR AUDIO / CLONE |
+| Storage (1TB+) | < $20 | 10 | SCAM (FAKE CAPACITY) |
+
+MANDATORY INSTRUCTION: 
+You are an AUDITOR.
+1. DO NOT give generic advice ("Check for X").
+2. DO NOT say "Unable to assess".
+3. FOR REVIEWS/COMPLAINTS: If no specific reviews are found, you MUST list "Likely Failures" for this category (e.g. "Battery Drain", "Motor Failure"). DO NOT LEAVE BLANK.
+"""
+
+# Filled with str.format per scan; the scraped page goes last so the fixed instructions lead
+LINK_PROMPT_TEMPLATE = """
+You are Veritas.
+
+CRITICAL CONTEXT: The URL suggests this item is a: {category}.
+
+TASK:
+1. Extract Exact "product_name" (Max 5 words).
+2. Apply Scoring Grid.
+3. JSON Output (Title Case Keys).
+4. "key_complaints": MUST contain a list of strings. If unknown, list generic risks for {category}.
+
+Return JSON: product_name, score, detailed_technical_analysis, key_complaints, reviews_summary.
+Content: {content}
+"""
+
+# Used when the page cannot be scraped; {context} is empty for unknown categories
+BACKUP_PROMPT_TEMPLATE = """
+I cannot access page directly.
+Target: {name}
+{context}
+
+MANDATORY: SEARCH for "{name} problems reddit" AND "{name} real vs fake".
+
+OUTPUT:
+- "product_name": EXTRACT REAL NAME (Max 5 words).
+- "key_complaints": LIST of actual problems found. If none, list "Expected Issues for Cheap {category}".
+
+Return JSON: product_name, score, detailed_technical_analysis, key_complaints, reviews_summary.
+"""
+
+IMAGE_PROMPT = """
+YOU ARE A FORENSIC ANALYST.
+
+STEP 1: READ TEXT & IDENTIFY PRODUCT from image.
+STEP 2: SEARCH GOOGLE for the identified product.
+
+RETURN JSON:
+{
+    "product_name": "Brand Model",
+    "score": 0-100,
+    "reviews_summary": ["Point 1", "Point 2"],
+    "key_complaints": ["Complaint 1", "Complaint 2"],
+    "detailed_technical_analysis": {"Price Check": ["..."], "Spec Verify": ["..."]}
+}
+"""
+
+# Thin scrapes get page text and search in one call instead of a content call that then falls back
+MARGINAL_CONTENT_CHARS = 1500
+FUSED_PROMPT_TEMPLATE = """
+You are Veritas.
+
+URL: {url}
+CRITICAL CONTEXT: The URL suggests this item is a: {category}.
+
+Scraped content (may be partial):
+{content}
+
+If the content is insufficient, identify the product from the URL (name: {name}) and
+SEARCH for "{name} problems reddit" AND "{name} real vs fake".
+
+OUTPUT:
+- "product_name": EXTRACT REAL NAME (Max 5 words).
+- "key_complaints": LIST of actual problems found. If none, list "Expected Issues for Cheap {category}".
+
+Return JSON: product_name, score, detailed_technical_analysis, key_complaints, reviews_summary.
+"""
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -19,12 +249,23 @@ st.set_page_config(
 )
 
 # --- STATE SETUP ---
+@dataclass(slots=True)
+class HistoryItem:
+    # Sidebar fields only; the full report is loaded from the disk cache via result_key
+    source: str
+    score: int
+    verdict: str
+    result_key: str
+    image_url: str | None
+
 if "history" not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = deque(maxlen=MAX_HISTORY)
 if "playback_data" not in st.session_state:
     st.session_state.playback_data = None
 if "uploader_id" not in st.session_state:
     st.session_state.uploader_id = 0
+if "history_table_id" not in st.session_state:
+    st.session_state.history_table_id = 0
 
 # --- CALLBACKS ---
 def clear_url_input():
@@ -41,79 +282,353 @@ def load_history_item(item):
 def close_playback():
     st.session_state.playback_data = None
 
+def clear_history():
+    disk_cache_delete([item.result_key for item in st.session_state.history])
+    st.session_state.history.clear()
+    st.session_state.playback_data = None
+
+# --- SCORE BANDS ---
+# Index 0: score <= 45 (risky), 1: mixed, 2: score >= 80 (safe)
+SCORE_EMOJI = ("🔴", "🟠", "🟢")
+SCORE_COLORS = ("red", "orange", "green")
+SCORE_ADVICE = ("⛔ DO NOT BUY. Poor quality/scam.", "⚠️ Mixed reviews. Expect issues.", "✅ Safe and well-reviewed.")
+
+def score_band(score):
+    return (score > 45) + (score >= 80)
+
+# Static styles for the verdict block; each render only fills in the band class and text
+VERDICT_CSS = "<style>" + """
+.veritas-verdict {text-align: center;}
+.veritas-verdict .score {font-size: 80px; font-weight: 700; line-height: 1.1;}
+.veritas-verdict .out-of {font-size: 40px; color: grey;}
+.veritas-verdict .advice {font-weight: 600;}
+""" + "".join(
+    f".veritas-verdict.band-{band} .score, .veritas-verdict.band-{band} .advice {{color: {color};}}\n"
+    for band, color in enumerate(SCORE_COLORS)
+) + "</style>"
+
+_SCORE_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+def coerce_score(raw, default=35):
+    """
+    Turns whatever landed in "score" (75, 75.0, "75", "75/100") into an int.
+    """
+    if type(raw) is int:  # Schema output: the common case, and excludes bool
+        return raw
+    if type(raw) is float:
+        return int(raw)
+    if isinstance(raw, str) and raw.isdigit():
+        return int(raw)
+    match = _SCORE_NUMBER_RE.search(raw) if isinstance(raw, str) else None
+    return int(float(match.group())) if match else default
+
+def history_row(item):
+    return {
+        "": SCORE_EMOJI[score_band(item.score)],
+        "Scan": item.source,
+        "Score": item.score,
+        "Verdict": item.verdict,
+    }
+
 # --- SIDEBAR: HISTORY ---
 with st.sidebar:
     st.header("📜 Recent Scans")
     if not st.session_state.history:
         st.caption("No searches yet.")
     else:
-        for index, item in enumerate(reversed(st.session_state.history)):
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                display_name = item['source']
-                if len(display_name) > 22:
-                    display_name = display_name[:20] + "..."
-                
-                st.button(
-                    display_name, 
-                    key=f"hist_btn_{index}", 
-                    use_container_width=True,
-                    on_click=load_history_item,
-                    args=(item,)
-                )
-            with col2:
-                raw = item.get('score', 35)
-                score = int(raw)
-                color = "🔴" if score <= 45 else "🟠" if score < 80 else "🟢"
-                st.write(f"{color} {score}")
-            
-            caption_text = item.get('standardized_verdict', item.get('verdict', 'Analysis'))
-            st.caption(caption_text)
-            st.divider()
+        # One table widget, however long the history gets
+        recent = list(islice(reversed(st.session_state.history), SIDEBAR_HISTORY_ITEMS))
+        event = st.dataframe(
+            [history_row(item) for item in recent],
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "": st.column_config.TextColumn(width="small"),
+                "Score": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%d"),
+            },
+            on_select="rerun",
+            selection_mode="single-row",
+            key=f"history_table_{st.session_state.history_table_id}"
+        )
+        if event.selection.rows:
+            # The sidebar renders before the main pane, so this run already shows the scan
+            load_history_item(recent[event.selection.rows[0]])
+            st.session_state.history_table_id += 1  # Fresh key so the row does not stay selected
     
-    if st.button("Clear History"):
-        st.session_state.history = []
-        st.session_state.playback_data = None
-        st.rerun()
+    st.button("Clear History", on_click=clear_history)
 
 # --- MAIN HEADER ---
 st.title("Veritas 🛡️")
 st.caption("The Truth Filter for the Internet")
 
 # --- HELPER FUNCTIONS ---
-def get_api_keys():
+@st.cache_resource(ttl="5m")
+def load_api_keys():
+    # GEMINI_KEYS / GEMINI_API_KEYS (comma-separated) pool several keys; a single key still works.
+    # The ttl lets rotated keys in secrets.toml take effect without a restart.
     gemini = st.secrets.get("GEMINI_KEY") or os.environ.get("GEMINI_API_KEY")
+    gemini_pool = st.secrets.get("GEMINI_KEYS") or os.environ.get("GEMINI_API_KEYS", "")
     firecrawl = st.secrets.get("FIRECRAWL_KEY") or os.environ.get("FIRECRAWL_API_KEY")
-    
-    if not gemini or not firecrawl:
+
+    if isinstance(gemini_pool, str):
+        gemini_pool = gemini_pool.split(",")
+    gemini_keys = tuple(k.strip() for k in gemini_pool if k.strip())
+    if not gemini_keys and gemini:
+        gemini_keys = (gemini,)
+    return gemini_keys, firecrawl
+
+def get_api_keys():
+    gemini_keys, firecrawl = load_api_keys()
+    if not gemini_keys or not firecrawl:
         st.error("🔑 API Keys missing! Check .streamlit/secrets.toml")
         st.stop()
-    return gemini, firecrawl
+    return gemini_keys, firecrawl
 
-def clean_and_parse_json(response_text):
-    match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-    text = match.group(1) if match else response_text.strip()
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+
+@st.cache_resource
+def get_fetch_executor():
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+@st.cache_resource
+def get_genai_client(api_key):
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+@st.cache_resource
+def get_firecrawl_app(api_key):
+    from firecrawl import Firecrawl
+    return Firecrawl(api_key=api_key)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a request may be sent.
+    """
+
+    def __init__(self, rate, per_seconds):
+        self._capacity = rate
+        self._tokens = float(rate)
+        self._fill_rate = rate / per_seconds
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self._fill_rate
+            time.sleep(delay)
+
+@st.cache_resource
+def get_gemini_limiter(api_key, model):
+    # One bucket per key and model per process, shared by every session (Gemini quotas are per key+model)
+    return TokenBucket(GEMINI_RPM, 60)
+
+class GeminiKeyPool:
+    """
+    Round-robins API keys, skipping keys that recently hit a rate limit.
+    """
+
+    def __init__(self, keys):
+        self._keys = keys
+        self._cursor = 0
+        self._cooling_until = {}
+        self._lock = threading.Lock()
+
+    def next_key(self):
+        with self._lock:
+            now = time.monotonic()
+            for _ in range(len(self._keys)):
+                key = self._keys[self._cursor % len(self._keys)]
+                self._cursor += 1
+                if self._cooling_until.get(key, 0) <= now:
+                    return key
+            # Every key is cooling: use the one that recovers first
+            return min(self._keys, key=self._cooling_until.get)
+
+    def cool_down(self, key):
+        with self._lock:
+            self._cooling_until[key] = time.monotonic() + KEY_COOLDOWN_SECONDS
+
+@st.cache_resource
+def get_gemini_key_pool(keys):
+    return GeminiKeyPool(keys)
+
+def is_rate_limited(error):
+    return getattr(error, 'code', None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+def _stream_model(key_pool, model, contents, config, chunks, stop):
+    # Worker thread: forwards (model, text, error) tuples; text=None marks the end
+    if stop.is_set():
+        return  # Lost the race or cancelled while queued; spend no rate-limit token
+    key = key_pool.next_key()
     try:
-        return json.loads(text, strict=False)
-    except json.JSONDecodeError:
-        sanitized = re.sub(r'[\x00-\x1f\x7f]', ' ', text)
+        get_gemini_limiter(key, model).acquire()
+        if stop.is_set():
+            return
+        client = get_genai_client(key)
+        for chunk in client.models.generate_content_stream(model=model, contents=contents, config=config):
+            if stop.is_set():
+                return
+            chunks.put((model, chunk.text or "", None))
+        chunks.put((model, None, None))
+    except Exception as e:
+        if is_rate_limited(e):
+            key_pool.cool_down(key)
+        chunks.put((model, None, e))
+
+def llm_cache_key(contents, config, models):
+    # Image parts hash by their bytes, so the same screenshot hits regardless of upload name
+    digest = hashlib.sha256(repr((config, tuple(models))).encode())
+    for item in contents if isinstance(contents, list) else [contents]:
+        blob = getattr(item, 'inline_data', None)
+        digest.update(blob.data if blob else str(item).encode())
+    return "llm:" + digest.hexdigest()
+
+class GenerationJob:
+    """
+    A streamed Gemini call raced across models with a staggered start. The first model to emit
+    a chunk wins and the others are stopped. Work starts on the shared executor immediately;
+    result() drains it on the calling thread, where on_progress(text_so_far) may touch the UI.
+    """
+
+    def __init__(self, key_pool, contents, config, models=GEMINI_MODELS):
+        self._key_pool = key_pool
+        self._contents = contents
+        self._config = config
+        self._cache_key = llm_cache_key(contents, config, models)
+        self._cached = disk_cache_get(self._cache_key, LLM_TTL_SECONDS)
+        self._models = iter(models)
+        self._chunks = queue.Queue()
+        self._stops = {}  # One Event per launched model, so losers can be stopped while the winner streams
+        self._running = 0 if self._cached is not None else self._launch_next()
+
+    def _launch_next(self):
+        model = next(self._models, None)
+        if model is None:
+            return 0
+        stop = self._stops[model] = threading.Event()
+        get_executor().submit(
+            _stream_model, self._key_pool, model, self._contents, self._config, self._chunks, stop
+        )
+        return 1
+
+    def _stop_all(self, keep=None):
+        for model, stop in self._stops.items():
+            if model != keep:
+                stop.set()
+
+    def cancel(self):
+        self._stop_all()
+
+    def result(self, on_progress=None):
+        if self._cached is not None:
+            if on_progress:
+                on_progress(self._cached)
+            return self._cached
+        winner = None
+        buffer = ""
+        last_error = None
+        try:
+            while self._running:
+                try:
+                    model, text, error = self._chunks.get(timeout=None if winner else FALLBACK_STAGGER)
+                except queue.Empty:
+                    self._running += self._launch_next()  # Nothing streamed yet: hedge with the next model
+                    continue
+                if winner and model != winner:
+                    continue
+                if error is not None:
+                    if winner:
+                        raise error
+                    last_error = error
+                    self._running -= 1
+                    self._running += self._launch_next()  # Failed fast: bring in the next model now
+                elif text is None:
+                    if not winner:
+                        # Ended without any text (safety block, empty grounded answer): a failure, not a result
+                        last_error = last_error or RuntimeError(f"{model} returned an empty response")
+                        self._running -= 1
+                        self._running += self._launch_next()
+                        continue
+                    if clean_and_parse_json(buffer):
+                        # Truncated or prose answers would be replayed on every retry; only usable JSON is kept
+                        disk_cache_set(self._cache_key, buffer)
+                    return buffer
+                elif text:
+                    if not winner:
+                        winner = model
+                        self._stop_all(keep=winner)  # Losers stop at their next chunk instead of streaming on
+                    buffer += text
+                    if on_progress:
+                        on_progress(buffer)
+        finally:
+            self._stop_all()
+        raise last_error
+
+def generate_with_fallback(key_pool, contents, config, on_progress=None, models=GEMINI_MODELS):
+    return GenerationJob(key_pool, contents, config, models).result(on_progress)
+
+def report_stream_progress(status_box, partial_text):
+    # Shows a progress counter rather than raw JSON; the score usually streams long before the analysis
+    label = f"Verifying... {len(partial_text):,} characters received"
+    match = _PARTIAL_SCORE_RE.search(partial_text)
+    if match:
+        label += f" · preliminary score {match.group(1)}/100"
+    status_box.update(label=label)
+
+def _outer_json_object(text):
+    # Brace-match the first top-level {...}, ignoring braces inside strings
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+# Keyed on a hash of the raw text; repeated identical responses skip the parse entirely
+@st.cache_data(max_entries=256, show_spinner=False)
+def clean_and_parse_json(response_text):
+    # orjson rejects raw control characters inside strings; scrubbing up front means one parse attempt
+    text = _FENCE_RE.sub('', response_text).translate(_CTRL_TABLE).strip()
+    for candidate in (text, _outer_json_object(text)):
+        if not candidate:
+            continue
         try:
-            return json.loads(sanitized, strict=False)
-        except:
-            return {}
+            parsed = orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    return {}
 
 def extract_score_safely(result_dict):
-    raw = result_dict.get("score")
-    score = 35 
-    
-    if isinstance(raw, (int, float)):
-        score = int(raw)
-    elif isinstance(raw, str):
-        nums = re.findall(r'\d+', raw)
-        if nums:
-            score = int(nums[0])
-            
-    return max(0, min(100, 5 * round(score / 5)))
+    score = (coerce_score(result_dict.get("score")) + 2) // 5 * 5  # Nearest multiple of 5; ints never tie
+    return 0 if score < 0 else 100 if score > 100 else score
 
 def get_standardized_verdict(score):
     if score <= 25:
@@ -139,23 +654,57 @@ def detect_category_from_url(url):
         return "AUDIO DEVICE"
     return "UNKNOWN ELECTRONICS"
 
-def extract_name_from_url(url):
+def normalize_url(url):
+    parsed = urlparse(url.strip())
+    query = [
+        (k, v) for k, v in parse_qsl(parsed.query)
+        if k.lower() not in TRACKING_PARAM_NAMES and not k.lower().startswith(TRACKING_PARAM_PREFIXES)
+    ]
+    return urlunparse(parsed._replace(
+        scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(), query=urlencode(sorted(query)), fragment=""
+    ))
+
+def get_result_cache_key(trigger, url, upload):
+    if trigger == "link" and url:
+        return f"result:v{PROMPT_VERSION}:link:" + hashlib.sha256(normalize_url(url).encode()).hexdigest()
+    if trigger == "image" and upload:
+        return f"result:v{PROMPT_VERSION}:image:" + hashlib.sha256(upload.getvalue()).hexdigest()
+    return None
+
+def evidence_image_source(image):
+    # Uploaded bytes pass through; remote URLs go via the proxy at 2x width for sharp high-DPI display
+    if not IMAGE_PROXY_TEMPLATE or not isinstance(image, str):
+        return image
+    return IMAGE_PROXY_TEMPLATE.format(url=quote(image, safe=''), width=2 * EVIDENCE_IMAGE_WIDTH)
+
+def is_hostile_host(host):
+    return any(domain in host for domain in HOSTILE_DOMAINS)
+
+def extract_item_id_label(parsed_url):
+    # Hosts are disjoint, so at most one pattern ever runs
+    host = parsed_url.netloc.lower()
+    for domain, (pattern, label) in _ITEM_ID_PATTERNS.items():
+        if domain in host:
+            match = pattern.search(f"{parsed_url.path}?{parsed_url.query}")
+            return label.format(match.group(1)) if match else None
+    return None
+
+def extract_name_from_url(parsed_url):
+    id_label = extract_item_id_label(parsed_url)
     try:
-        path = urlparse(url).path
+        path = parsed_url.path
         if path.endswith('.html'): path = path[:-5]
         segments = [s for s in path.split('/') if s and not s.isdigit()]
         if segments:
             slug = max(segments, key=len)
+            # A lone word ("item") or a bare ASIN says less than the storefront ID
+            if id_label and '-' not in slug and '_' not in slug: return id_label
             clean_name = slug.replace('-', ' ').replace('_', ' ').title()
             if len(clean_name) > 30: clean_name = clean_name[:30] + "..."
             if len(clean_name) > 3: return clean_name
-    except:
+    except Exception:
         pass
-    ali_match = re.search(r'/item/(\d+)\.html', url)
-    if ali_match: return f"AliExpress Item {ali_match.group(1)}"
-    amz_match = re.search(r'/(dp|gp/product)/([A-Z0-9]{10})', url)
-    if amz_match: return f"Amazon Item {amz_match.group(2)}"
-    return "Unidentified Item"
+    return id_label or "Unidentified Item"
 
 def sanitize_product_name(name):
     if not name: return "Unidentified Item"
@@ -164,6 +713,69 @@ def sanitize_product_name(name):
     if any(p in name.lower() for p in bad_phrases): return "Unidentified Item"
     return name
 
+def prepare_upload_image(uploaded_file):
+    """
+    Returns (bytes, mime_type) for Gemini. Pixels are only decoded when the image must shrink.
+    """
+    from io import BytesIO
+    from PIL import Image
+    data = uploaded_file.getvalue()
+    img = Image.open(BytesIO(data))  # Reads the header only
+    if max(img.size) <= MAX_UPLOAD_EDGE:
+        return data, uploaded_file.type or Image.MIME.get(img.format, "image/png")
+    img.draft("RGB", (MAX_UPLOAD_EDGE, MAX_UPLOAD_EDGE))  # JPEG only: libjpeg decodes at 1/2-1/8 scale
+    img.thumbnail((MAX_UPLOAD_EDGE, MAX_UPLOAD_EDGE), Image.Resampling.LANCZOS)
+    buf = BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    return buf.getvalue(), "image/jpeg"
+
+def make_history_thumbnail(data):
+    from io import BytesIO
+    from PIL import Image
+    img = Image.open(BytesIO(data))
+    img.draft("RGB", (HISTORY_THUMB_EDGE, HISTORY_THUMB_EDGE))
+    img.thumbnail((HISTORY_THUMB_EDGE, HISTORY_THUMB_EDGE), Image.Resampling.LANCZOS)
+    buf = BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+def make_image_part(data, mime_type):
+    from google.genai import types
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+def extract_product_signal(markdown, token_budget):
+    """
+    Keeps the page title plus the blocks densest in price/spec/review keywords, in page order.
+    """
+    budget = token_budget * CHARS_PER_TOKEN
+    blocks = []
+    # Image embeds and base64 data URIs cost tokens but carry nothing the model can read here
+    text = _SPACE_RUN_RE.sub(' ', _INLINE_IMAGE_RE.sub('', markdown))
+    for raw_block in text.split("\n\n"):
+        lines = [
+            _INLINE_LINK_RE.sub(r'\1', line).strip()
+            for line in raw_block.splitlines() if line.strip() and not _LINK_ONLY_LINE_RE.match(line)
+        ]
+        if lines:
+            blocks.append("\n".join(lines))
+    if sum(len(b) for b in blocks) <= budget:
+        return "\n\n".join(blocks)
+
+    # Nav menus are link-only and footers keyword-free, so both rank last
+    ranked = sorted(
+        range(1, len(blocks)),
+        key=lambda i: len(_SIGNAL_RE.findall(blocks[i])) / (len(blocks[i]) + 50),
+        reverse=True
+    )
+    keep = {0}
+    used = len(blocks[0])
+    for i in ranked:
+        if used + len(blocks[i]) > budget:
+            continue
+        keep.add(i)
+        used += len(blocks[i])
+    return "\n\n".join(blocks[i] for i in sorted(keep))[:budget]
+
 def filter_empty_sections(analysis_dict):
     """
     Removes sections that contain generic advice or are empty.
@@ -190,23 +802,282 @@ def filter_empty_sections(analysis_dict):
             
     return cleaned_dict
 
-# --- SCRAPING ---
-@st.cache_data(ttl="24h", show_spinner=False)
-def scrape_website(url, _api_key):
+# --- DISK CACHE ---
+def prune_disk_cache(conn):
+    conn.execute("DELETE FROM cache WHERE stored_at < ?", (time.time() - CACHE_MAX_AGE_SECONDS,))
+    conn.execute(
+        # History reports are left to the age limit and history eviction; the row cap must not drop a live scan
+        "DELETE FROM cache WHERE key NOT LIKE 'history:%' AND key NOT IN "
+        "(SELECT key FROM cache WHERE key NOT LIKE 'history:%' ORDER BY stored_at DESC LIMIT ?)",
+        (CACHE_MAX_ROWS,)
+    )
+
+@st.cache_resource
+def init_disk_cache():
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value BLOB NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+        prune_disk_cache(conn)
+    return CACHE_DB_PATH
+
+@st.cache_resource
+def get_disk_cache_writes():
+    return count(1)  # next() is atomic under the GIL, so sessions can share it
+
+def disk_cache_get(key, ttl):
+    # ttl=None returns the entry however old it is (stale fallback)
+    try:
+        with closing(sqlite3.connect(init_disk_cache())) as conn:
+            row = conn.execute("SELECT stored_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row and (ttl is None or time.time() - row[0] < ttl):
+            return pickle.loads(row[1])
+    except Exception:  # Locked db, corrupt row, or a class Streamlit rebound mid-rerun: all just a miss
+        pass
+    return None
+
+def disk_cache_set(key, value):
     try:
-        app = Firecrawl(api_key=_api_key)
-        params = {'formats': ['markdown'], 'mobile': True}
+        with closing(sqlite3.connect(init_disk_cache())) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, time.time(), pickle.dumps(value)))
+            if next(get_disk_cache_writes()) % CACHE_PRUNE_EVERY == 0:
+                prune_disk_cache(conn)
+    except (sqlite3.Error, pickle.PicklingError):
+        pass
+
+def disk_cache_delete(keys):
+    try:
+        with closing(sqlite3.connect(init_disk_cache())) as conn, conn:
+            conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+    except sqlite3.Error:
+        pass
+
+# --- SCRAPING ---
+@st.cache_resource(max_entries=256, ttl="1h")  # An evicted host just gets a fresh semaphore on its next fetch
+def get_host_semaphore(host):
+    return threading.BoundedSemaphore(HOST_FETCH_CONCURRENCY)
+
+class ScrapeResult(NamedTuple):
+    # Only what the link path reads; keeps cache entries small and SDK-independent
+    markdown: str
+    og_image: str | None
+    stale: bool = False
+
+def is_trap_page(page):
+    return _TRAP_RE.search(page.markdown, 0, TRAP_SCAN_CHARS) is not None
+
+class TrapPageError(Exception):
+    # Carries a trap page out of the cached scrape; st.cache_data does not cache exceptions
+    def __init__(self, page):
+        super().__init__("trap page")
+        self.page = page
+
+def scrape_cache_key(url):
+    return "scrape:v2:" + hashlib.sha256(url.encode()).hexdigest()
+
+def disk_cache_get_page(key, ttl):
+    # Pages are stored as plain (markdown, og_image) tuples; pickling ScrapeResult would pin __main__, which reruns rebind
+    cached = disk_cache_get(key, ttl)
+    return ScrapeResult(*cached[:2]) if cached is not None else None
+
+def disk_cache_set_page(key, page):
+    disk_cache_set(key, (page.markdown, page.og_image))
+
+def firecrawl_scrape(url, api_key, stop=None):
+    # Uncached; raises on API errors and returns None for an empty response
+    app = get_firecrawl_app(api_key)
+    with get_host_semaphore(urlparse(url).netloc.lower()):
+        if stop is not None and stop.is_set():
+            raise CancelledError("the plain fetch already won")  # Queued behind the host limit; skip the credit
         if hasattr(app, 'scrape_url'):
-            return app.scrape_url(url, params=params)
-        return app.scrape(url)
-    except:
+            params = {'formats': SCRAPE_FORMATS, 'mobile': True, 'onlyMainContent': True,
+                      'excludeTags': SCRAPE_EXCLUDE_TAGS, 'waitFor': SCRAPE_WAIT_MS, 'timeout': SCRAPE_TIMEOUT_MS}
+            scraped = app.scrape_url(url, params=params)
+        else:
+            scraped = app.scrape(url, formats=SCRAPE_FORMATS, mobile=True, only_main_content=True,
+                                 exclude_tags=SCRAPE_EXCLUDE_TAGS, wait_for=SCRAPE_WAIT_MS,
+                                 timeout=SCRAPE_TIMEOUT_MS)
+    if not scraped:
+        return None
+    meta = getattr(scraped, 'metadata', None) or {}
+    og_image = meta.get('og:image') if isinstance(meta, dict) else getattr(meta, 'og_image', None)
+    return ScrapeResult(getattr(scraped, 'markdown', '') or '', og_image)
+
+@st.cache_data(ttl="24h", max_entries=500, show_spinner=False)
+def _scrape_website_cached(url, _api_key, _stop=None):
+    # st.cache_data is the in-process L1; the disk cache survives restarts. Errors propagate and are never cached
+    cache_key = scrape_cache_key(url)
+    cached = disk_cache_get_page(cache_key, SCRAPE_TTL_SECONDS)
+    if cached is not None:
+        return cached
+    page = firecrawl_scrape(url, _api_key, _stop)
+    if page and is_trap_page(page):
+        raise TrapPageError(page)
+    if page:
+        disk_cache_set_page(cache_key, page)
+    return page
+
+def scrape_website(url, api_key, stop=None):
+    # The stale fallback lives outside the L1 cache so it is served only until Firecrawl recovers
+    try:
+        return _scrape_website_cached(url, api_key, stop)
+    except CancelledError:
+        return None
+    except TrapPageError as trap:
+        return trap.page  # Neither cache keeps it, so the next request scrapes afresh
+    except Exception:
+        stale = disk_cache_get_page(scrape_cache_key(url), None)
+        return stale._replace(stale=True) if stale is not None else None
+
+def retry_scrape(url, api_key):
+    """
+    Fresh scrapes after a trap page, backing off after each failure and hedging slow attempts;
+    the first clean result wins and refreshes the disk cache.
+    """
+    def first_clean(futures):
+        for future in futures:
+            page = future.result() if future.exception() is None else None
+            if page and len(page.markdown) >= MIN_PAGE_CHARS and not is_trap_page(page):
+                return page
         return None
 
+    executor = get_fetch_executor()
+    deadline = time.monotonic() + SCRAPE_RETRY_BUDGET
+    pending = set()
+    page = None
+    for attempt in range(SCRAPE_RETRY_ATTEMPTS):
+        if not pending:
+            # The last attempt (at first, the trap page itself) failed outright
+            backoff = SCRAPE_RETRY_BACKOFF * 2 ** attempt + random.uniform(0, SCRAPE_RETRY_BACKOFF)
+            time.sleep(max(0.0, min(backoff, SCRAPE_RETRY_BACKOFF_CAP, deadline - time.monotonic())))
+        pending.add(executor.submit(firecrawl_scrape, url, api_key))
+        done, pending = wait(pending, timeout=SCRAPE_RETRY_HEDGE, return_when=FIRST_COMPLETED)
+        page = first_clean(done)
+        if page:
+            break
+    while not page and pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        page = first_clean(done)
+    if page:
+        disk_cache_set_page(scrape_cache_key(url), page)
+    return page
+
+def is_public_http_url(url):
+    # The plain fetch runs on our server, so user URLs must not reach internal addresses
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError, UnicodeError):
+        return False
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global or address.is_multicast:  # is_global excludes private, loopback, link-local, reserved
+            return False
+    return True
+
+def _abort_response(response):
+    # Closing does not wake a read blocked in another thread; shutting the socket down does
+    conn = getattr(response.raw, 'connection', None) or getattr(response.raw, '_connection', None)
+    sock = getattr(conn, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def read_html_body(response, deadline):
+    # Streamed body: HTML only, capped at PLAIN_FETCH_MAX_BYTES, never read past the deadline
+    content_type = response.headers.get('Content-Type', '').lower()
+    if not content_type.startswith('text/html'):
+        raise ValueError(f"Not an HTML page: {content_type or 'no content type'}")
+    watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _abort_response, (response,))
+    watchdog.start()
+    body = bytearray()
+    try:
+        for chunk in response.iter_content(PLAIN_FETCH_CHUNK_BYTES):
+            body += chunk
+            if len(body) >= PLAIN_FETCH_MAX_BYTES or time.monotonic() >= deadline:
+                break
+    finally:
+        watchdog.cancel()
+    if time.monotonic() >= deadline:
+        raise TimeoutError("Plain fetch ran past its deadline")
+    return bytes(body[:PLAIN_FETCH_MAX_BYTES]).decode(response.encoding or 'utf-8', errors='replace')
+
+def fetch_plain_page(url):
+    # Same ScrapeResult as scrape_website so callers need not care which fetch won
+    import requests
+    deadline = time.monotonic() + PLAIN_FETCH_DEADLINE
+    with get_host_semaphore(urlparse(url).netloc.lower()):
+        for _ in range(PLAIN_FETCH_MAX_REDIRECTS + 1):
+            if not is_public_http_url(url):
+                raise ValueError(f"Refusing to fetch non-public URL: {url}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Plain fetch ran past its deadline")
+            with closing(requests.get(url, headers=PLAIN_FETCH_HEADERS, timeout=min(PLAIN_FETCH_TIMEOUT, remaining),
+                                      allow_redirects=False, stream=True)) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers['location'])
+                    continue
+                response.raise_for_status()
+                html = read_html_body(response, deadline)
+                break
+        else:
+            raise ValueError("Too many redirects")
+    text = unescape(_TAG_RE.sub('\n', _SCRIPT_STYLE_RE.sub('', html)))
+    text = "\n\n".join(line.strip() for line in text.splitlines() if line.strip())
+    og_image = _OG_IMAGE_RE.search(html)
+    return ScrapeResult(text, og_image.group(1) if og_image else None)
+
+def is_usable_page(page):
+    content = page.markdown if page else ''
+    return len(content) >= PLAIN_FETCH_MIN_CHARS and not is_trap_page(page)
+
+class PageFetch(NamedTuple):
+    plain: Future
+    scrape: Future
+    stop: threading.Event  # Set when the plain fetch wins so a Firecrawl call that has not started is dropped
+
+def start_page_fetch(url, api_key):
+    executor = get_fetch_executor()
+    stop = threading.Event()
+    return PageFetch(executor.submit(fetch_plain_page, url), executor.submit(scrape_website, url, api_key, stop), stop)
+
+def wait_for_page(page_fetch, timeout):
+    # True once Firecrawl has answered or the plain fetch returned a usable page; a failed plain GET does not count
+    plain_future, scrape_future, _ = page_fetch
+    deadline = time.monotonic() + timeout
+    done, _ = wait((plain_future, scrape_future), timeout=timeout, return_when=FIRST_COMPLETED)
+    if scrape_future in done:
+        return True
+    if plain_future in done and plain_future.exception() is None and is_usable_page(plain_future.result()):
+        return True
+    return bool(wait((scrape_future,), timeout=max(0.0, deadline - time.monotonic()))[0])
+
+def resolve_page_fetch(page_fetch):
+    plain_future, scrape_future, stop = page_fetch
+    wait((plain_future, scrape_future), return_when=FIRST_COMPLETED)
+    if plain_future.done() and plain_future.exception() is None and is_usable_page(plain_future.result()):
+        # A Firecrawl call already in flight cannot be aborted; one still queued or waiting on the host is skipped
+        stop.set()
+        scrape_future.cancel()
+        return plain_future.result()
+    scraped = scrape_future.result()
+    if scraped is None and plain_future.exception() is None and is_usable_page(plain_future.result()):
+        return plain_future.result()
+    return scraped
+
 # --- INPUT UI ---
 if not st.session_state.playback_data:
     tab1, tab2 = st.tabs(["🔗 Paste Link", "📸 Upload Screenshot"])
     target_url = None
     uploaded_image = None
+    uploaded_mime = None
     analysis_trigger = False
 
     with tab1:
@@ -225,7 +1096,7 @@ if not st.session_state.playback_data:
         c3, c4 = st.columns([1, 1])
         with c3:
             if uploaded_file and st.button("Analyze Screenshot", type="primary", use_container_width=True):
-                uploaded_image = Image.open(uploaded_file)
+                uploaded_image, uploaded_mime = prepare_upload_image(uploaded_file)
                 analysis_trigger = "image"
         with c4:
             st.button("New Upload", type="secondary", use_container_width=True, on_click=clear_img_input)
@@ -237,7 +1108,7 @@ else:
 
 # --- MAIN LOGIC ---
 if analysis_trigger:
-    gemini_key, firecrawl_key = get_api_keys()
+    gemini_keys, firecrawl_key = get_api_keys()
     result = {}
     score = 35 
     product_image_url = None
@@ -245,156 +1116,138 @@ if analysis_trigger:
     # CASE 1: PLAYBACK
     if analysis_trigger == "playback":
         data = st.session_state.playback_data
-        result = data['result']
-        score = extract_score_safely(result)
-        standardized_verdict = get_standardized_verdict(score) 
-        st.success(f"📂 Loaded from History: {data['source']}")
+        stored = disk_cache_get(data.result_key, None)
+        result = stored['result'] if stored else {}
+        product_image_url = (stored or {}).get('image') or data.image_url
+        if stored:
+            score = extract_score_safely(result)
+            standardized_verdict = get_standardized_verdict(score)
+        else:
+            # The sidebar entry still has the real score; the default of 35 would misreport it
+            st.warning("⚠️ The full report for this scan is no longer stored.")
+            score = data.score
+            standardized_verdict = data.verdict
+        st.success(f"📂 Loaded from History: {data.source}")
 
     # CASE 2: NEW ANALYSIS
-    elif gemini_key and firecrawl_key:
+    elif gemini_keys and firecrawl_key:
         status_box = st.status("Verifying...", expanded=False)
         
         try:
-            client = genai.Client(api_key=gemini_key)
-            
-            consistency_rules = """
-            VERITAS SCORING GRID (STRICT COMPLIANCE):
-            LOOKUP TABLE (Max Scores):
-            | CATEGORY | PRICE LIMIT | MAX SCORE | VERDICT |
-            | :--- | :--- | :--- | :--- |
-            | Drone / Quadcopter | < $60 | 35 | TOY GRADE / JUNK |
-            | Projector (1080p/4K) | < $80 | 35 | FAKE SPECS / DIM |
-            | Smartwatch (Clone) | < $40 | 35 | E-WASTE / LAGGY |
-            | Earbuds (TWS) | < $30 | 35 | POOR AUDIO / CLONE |
-            | Storage (1TB+) | < $20 | 10 | SCAM (FAKE CAPACITY) |
-
-            MANDATORY INSTRUCTION: 
-            You are an AUDITOR.
-            1. DO NOT give generic advice ("Check for X").
-            2. DO NOT say "Unable to assess".
-            3. FOR REVIEWS/COMPLAINTS: If no specific reviews are found, you MUST list "Likely Failures" for this category (e.g. "Battery Drain", "Motor Failure"). DO NOT LEAVE BLANK.
-            """
+            # Identical product URLs / screenshots reuse an earlier verdict
+            result_cache_key = get_result_cache_key(analysis_trigger, target_url, uploaded_file)
+            cached_result = disk_cache_get(result_cache_key, RESULT_TTL_SECONDS) if result_cache_key else None
+            cache_verdict = True
+
+            # Parsed once; the host drives the hostile check, the name fallback reads the path
+            target_parts = urlparse(target_url) if analysis_trigger == "link" and target_url else None
+            target_host = target_parts.netloc.lower() if target_parts else ""
+
+            # Start the first fetch attempt now so it overlaps Gemini setup
+            page_fetch = None
+            if cached_result is None and target_parts and not is_hostile_host(target_host):
+                page_fetch = start_page_fetch(target_url, firecrawl_key)
+
+            key_pool = get_gemini_key_pool(gemini_keys)
+
+            # === CACHED RESULT ===
+            if cached_result is not None:
+                result = cached_result["result"]
+                product_image_url = cached_result["image_url"]
+                if target_parts:
+                    fallback_name = extract_name_from_url(target_parts)
 
             # === PATH A: LINK ANALYSIS ===
-            if analysis_trigger == "link" and target_url:
+            elif analysis_trigger == "link" and target_url:
                 
-                fallback_name = extract_name_from_url(target_url)
+                fallback_name = extract_name_from_url(target_parts)
                 detected_category = detect_category_from_url(target_url)
-                is_hostile = "aliexpress" in target_url.lower() or "temu" in target_url.lower()
+                is_hostile = is_hostile_host(target_host)
+
+                context_injection = ""
+                if detected_category != "UNKNOWN ELECTRONICS":
+                    context_injection = f"THIS IS A {detected_category}. Focus search on {detected_category} failures."
+                backup_prompt = BACKUP_PROMPT_TEMPLATE.format(
+                    name=fallback_name, context=context_injection, category=detected_category
+                )
+                backup_config = {'system_instruction': CONSISTENCY_RULES, 'tools': [{'google_search': {}}], 'temperature': 0.0}
+                backup_job = None
                 
                 scraped_data = None
                 scrape_error = True 
                 content = ""
                 
                 if not is_hostile:
-                    MAX_RETRIES = 3
-                    for attempt in range(MAX_RETRIES):
-                        try:
-                            scraped_data = scrape_website(target_url, firecrawl_key)
-                            if scraped_data:
-                                content = getattr(scraped_data, 'markdown', '')
-                                content_str = str(content).lower()
-                                if len(content_str) < 500: 
-                                    scrape_error = True
-                                    break
-                                is_trap = any(x in content_str for x in ["captcha", "robot check", "login", "access denied"])
-                                if not is_trap:
-                                    scrape_error = False
-                                    break 
-                                else:
-                                    time.sleep(1)
-                        except:
-                            pass
+                    # Slow scrapes often end in a block page; overlap the backup with the wait
+                    if page_fetch and not wait_for_page(page_fetch, SPECULATIVE_BACKUP_DELAY):
+                        backup_job = GenerationJob(key_pool, backup_prompt, backup_config)
+
+                    try:
+                        scraped_data = resolve_page_fetch(page_fetch) if page_fetch else scrape_website(target_url, firecrawl_key)
+                    except Exception:
+                        scraped_data = None
+                    if scraped_data and len(scraped_data.markdown) >= MIN_PAGE_CHARS and is_trap_page(scraped_data):
+                        # The cached scrape is the trap itself; only fresh attempts can get past it
+                        status_box.update(label="Verifying... retrying past a bot check")
+                        # Retries can take the whole budget; the search backup runs alongside so the cost is the max
+                        backup_job = backup_job or GenerationJob(key_pool, backup_prompt, backup_config)
+                        scraped_data = retry_scrape(target_url, firecrawl_key)
+                    if scraped_data and len(scraped_data.markdown) >= MIN_PAGE_CHARS:
+                        content = scraped_data.markdown  # Always a str on ScrapeResult
+                        scrape_error = False
+                    # A stale copy or an outage-driven search fallback must not pin this verdict for every user
+                    cache_verdict = not (scrape_error or scraped_data.stale)
                 
                 # 1. Primary Analysis
                 if not scrape_error and scraped_data:
-                    meta = getattr(scraped_data, 'metadata', {})
-                    product_image_url = meta.get('og:image') if isinstance(meta, dict) else getattr(meta, 'og_image', None)
-
-                    prompt = f"""
-                    You are Veritas.
-                    {consistency_rules}
-                    
-                    CRITICAL CONTEXT: The URL suggests this item is a: {detected_category}. 
-                    
-                    TASK:
-                    1. Extract Exact "product_name" (Max 5 words).
-                    2. Apply Scoring Grid.
-                    3. JSON Output (Title Case Keys).
-                    4. "key_complaints": MUST contain a list of strings. If unknown, list generic risks for {detected_category}.
-
-                    Return JSON: product_name, score, detailed_technical_analysis, key_complaints, reviews_summary.
-                    Content: {str(content)[:25000]}
-                    """
-                    response = client.models.generate_content(
-                        model='gemini-2.0-flash', 
-                        contents=prompt,
-                        config={'temperature': 0.0}
-                    )
-                    temp_result = clean_and_parse_json(response.text)
+                    if scraped_data.stale:
+                        st.warning("⚠️ Live page unavailable right now. Using a cached copy from an earlier scan.")
+                    product_image_url = scraped_data.og_image
+                    page_signal = extract_product_signal(content, PROMPT_CONTENT_TOKENS)
+                    if len(content) < MARGINAL_CONTENT_CHARS:
+                        # Search tools and response_schema cannot be combined, so this call parses free-form JSON
+                        prompt = FUSED_PROMPT_TEMPLATE.format(
+                            url=target_url, category=detected_category, content=page_signal, name=fallback_name
+                        )
+                        response_text = generate_with_fallback(
+                            key_pool, prompt, backup_config, on_progress=partial(report_stream_progress, status_box)
+                        )
+                    else:
+                        prompt = LINK_PROMPT_TEMPLATE.format(category=detected_category, content=page_signal)
+                        response_text = generate_with_fallback(
+                            key_pool, prompt,
+                            {'system_instruction': CONSISTENCY_RULES, 'temperature': 0.0, 'max_output_tokens': MAX_OUTPUT_TOKENS,
+                             'response_mime_type': 'application/json', 'response_schema': ANALYSIS_SCHEMA},
+                            on_progress=partial(report_stream_progress, status_box), models=LOW_LATENCY_MODELS
+                        )
+                    temp_result = clean_and_parse_json(response_text)
                     
                     if temp_result.get("product_name") in ["Unknown", "Generic"] or extract_score_safely(temp_result) == 35:
                          scrape_error = True
                     else:
                         result = temp_result
+                        if backup_job:
+                            backup_job.cancel()
 
                 # 2. Backup Deep Search
                 if scrape_error or not result:
-                    search_query_1 = f"{fallback_name} problems reddit"
-                    search_query_2 = f"{fallback_name} real vs fake"
-                    context_injection = ""
-                    if detected_category != "UNKNOWN ELECTRONICS":
-                        context_injection = f"THIS IS A {detected_category}. Focus search on {detected_category} failures."
-                    
-                    prompt = f"""
-                    I cannot access page directly. 
-                    Target: {fallback_name}
-                    {context_injection}
-                    
-                    MANDATORY: SEARCH for "{search_query_1}" AND "{search_query_2}".
-                    
-                    {consistency_rules}
-                    
-                    OUTPUT:
-                    - "product_name": EXTRACT REAL NAME (Max 5 words).
-                    - "key_complaints": LIST of actual problems found. If none, list "Expected Issues for Cheap {detected_category}".
-
-                    Return JSON: product_name, score, detailed_technical_analysis, key_complaints, reviews_summary.
-                    """
-                    response = client.models.generate_content(
-                        model='gemini-2.0-flash', 
-                        contents=prompt,
-                        config={'tools': [{'google_search': {}}], 'temperature': 0.0}
-                    )
-                    result = clean_and_parse_json(response.text)
+                    backup_job = backup_job or GenerationJob(key_pool, backup_prompt, backup_config)
+                    response_text = backup_job.result(on_progress=partial(report_stream_progress, status_box))
+                    result = clean_and_parse_json(response_text)
 
             # === PATH B: IMAGE ANALYSIS ===
             elif analysis_trigger == "image" and uploaded_image:
-                prompt = f"""
-                YOU ARE A FORENSIC ANALYST.
-                
-                STEP 1: READ TEXT & IDENTIFY PRODUCT from image.
-                STEP 2: SEARCH GOOGLE for the identified product.
-                
-                {consistency_rules}
-
-                RETURN JSON:
-                {{
-                    "product_name": "Brand Model",
-                    "score": 0-100,
-                    "reviews_summary": ["Point 1", "Point 2"],
-                    "key_complaints": ["Complaint 1", "Complaint 2"],
-                    "detailed_technical_analysis": {{"Price Check": ["..."], "Spec Verify": ["..."]}}
-                }}
-                """
-                response = client.models.generate_content(
-                    model='gemini-2.0-flash', 
-                    contents=[prompt, uploaded_image],
-                    config={'tools': [{'google_search': {}}], 'temperature': 0.1} 
+                response_text = generate_with_fallback(
+                    key_pool, [IMAGE_PROMPT, make_image_part(uploaded_image, uploaded_mime)],
+                    {'system_instruction': CONSISTENCY_RULES, 'tools': [{'google_search': {}}], 'temperature': 0.1},
+                    on_progress=partial(report_stream_progress, status_box)
                 )
-                result = clean_and_parse_json(response.text)
+                result = clean_and_parse_json(response_text)
 
             # PARSE & SAVE
+            if cached_result is None and result_cache_key and result and cache_verdict:
+                disk_cache_set(result_cache_key, {"result": result, "image_url": product_image_url})
+
             score = extract_score_safely(result)
             standardized_verdict = get_standardized_verdict(score)
             
@@ -406,41 +1259,60 @@ if analysis_trigger:
             else:
                  final_name = clean_name
 
-            st.session_state.history.append({
-                "source": final_name,
-                "score": score,
-                "verdict": standardized_verdict,
-                "standardized_verdict": standardized_verdict,
-                "result": result,
-                "image_url": product_image_url
-            })
+            history_key = "history:" + uuid.uuid4().hex
+            history_entry = {"result": result}
+            if analysis_trigger == "image" and uploaded_image:
+                history_entry["image"] = make_history_thumbnail(uploaded_image)
+            disk_cache_set(history_key, history_entry)
+            if len(st.session_state.history) == MAX_HISTORY:
+                disk_cache_delete([st.session_state.history[0].result_key])  # The deque is about to evict it
+            st.session_state.history.append(HistoryItem(
+                source=final_name,
+                score=score,
+                verdict=standardized_verdict,
+                result_key=history_key,
+                image_url=product_image_url
+            ))
             status_box.update(label="✅ Complete", state="complete", expanded=False)
 
         except Exception as e:
             status_box.update(label="❌ Error", state="error")
             st.error(f"Details: {str(e)}")
-            st.code(traceback.format_exc())
+            if st.secrets.get("DEBUG"):
+                # Stack traces leak paths and internals; only shown when explicitly enabled
+                import traceback
+                st.code(traceback.format_exc())
             st.stop()
 
     # --- DISPLAY ---
     st.divider()
+    # Unpacked once; every tab below reads these locals
+    analysis_data = result.get("detailed_technical_analysis") or {}
+    complaints_data = result.get("key_complaints")
+    reviews_data = result.get("reviews_summary")
     
     display_image = product_image_url
-    if analysis_trigger == "playback": display_image = st.session_state.playback_data.get("image_url")
     if analysis_trigger == "image" and uploaded_image: display_image = uploaded_image
 
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if display_image: st.image(display_image, caption="Evidence", width=200)
+        if display_image: st.image(evidence_image_source(display_image), caption="Evidence", width=EVIDENCE_IMAGE_WIDTH)
 
     t1, t2 = st.tabs(["🛡️ Verdict", "💬 Reviews"])
     
     with t1:
-        color = "red" if score <= 45 else "orange" if score < 80 else "green"
-        st.markdown(f"<h1 style='text-align: center; color: {color}; font-size: 80px;'>{score}<span style='font-size: 40px; color: grey;'>/100</span></h1>", unsafe_allow_html=True)
+        band = score_band(score)
         # Safe access
         verdict_text = locals().get('standardized_verdict', result.get('verdict', 'Analysis Complete'))
-        st.markdown(f"<h3 style='text-align: center;'>{verdict_text}</h3>", unsafe_allow_html=True)
+        # Score, verdict and advice go out as one element
+        st.html(
+            VERDICT_CSS +
+            f"<div class='veritas-verdict band-{band}'>"
+            f"<div class='score'>{score}<span class='out-of'>/100</span></div>"
+            f"<h3>{escape(str(verdict_text))}</h3>"
+            f"<p class='advice'>{SCORE_ADVICE[band]}</p>"
+            f"</div>"
+        )
         
         with st.expander("ℹ️ Why is this score different on other sites?"):
             st.info("""
@@ -448,38 +1320,28 @@ if analysis_trigger:
             * **Amazon/Walmart:** Safer returns, warranty, faster shipping.
             * **Temu/AliExpress:** Deducts max 10 points for shipping/return risks.
             """)
-
-        if score <= 45: st.error("⛔ DO NOT BUY. Poor quality/scam.")
-        elif score < 80: st.warning("⚠️ Mixed reviews. Expect issues.")
-        else: st.success("✅ Safe and well-reviewed.")
         
         st.divider()
         
         # --- DEEP DIVE WITH EMPTY SECTION FILTER ---
-        raw_analysis_data = result.get("detailed_technical_analysis", {})
-        cleaned_analysis = filter_empty_sections(raw_analysis_data)
+        cleaned_analysis = filter_empty_sections(analysis_data)
         
         if cleaned_analysis:
             with st.expander("🔍 Click for Deep Dive Analysis"):
+                sections = []
                 for header, bullets in cleaned_analysis.items():
                     clean_header = header.replace("_", " ").title()
-                    st.markdown(f"### {clean_header}") 
-                    if isinstance(bullets, list):
-                        for bullet in bullets:
-                            st.markdown(f"- {bullet}")
-                    else:
-                        st.markdown(str(bullets))
-                    st.markdown("")
+                    body = "\n".join(f"- {bullet}" for bullet in bullets) if isinstance(bullets, list) else str(bullets)
+                    sections.append(f"### {clean_header}\n{body}")
+                st.markdown("\n\n".join(sections))
         else:
             st.caption("No deep technical data available for this item.")
 
     with t2:
         st.subheader("Consensus")
-        complaints_data = result.get("key_complaints")
         if complaints_data:
             if isinstance(complaints_data, list):
-                for c in complaints_data:
-                    st.markdown(f"**🚨** {c}")
+                st.markdown("\n\n".join(f"**🚨** {c}" for c in complaints_data))
             elif isinstance(complaints_data, str):
                 st.markdown(f"**🚨** {complaints_data}")
         else:
@@ -488,11 +1350,9 @@ if analysis_trigger:
         
         st.divider()
         st.subheader("Source Summaries")
-        reviews_data = result.get("reviews_summary", [])
-        if isinstance(reviews_data, list):
-            for review in reviews_data:
-                st.markdown(f"**•** {review}")
-        elif isinstance(reviews_data, str):
+        if reviews_data and isinstance(reviews_data, list):
+            st.markdown("\n\n".join(f"**•** {review}" for review in reviews_data))
+        elif reviews_data and isinstance(reviews_data, str):
             st.markdown(reviews_data)
         else:
             st.caption("No review data found.")